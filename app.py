@@ -1,37 +1,151 @@
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+from flask import Flask, render_template, stream_template, request, redirect, url_for, session, flash, get_flashed_messages, Response, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_session import Session
+from flask_compress import Compress
+from cachelib import FileSystemCache
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import load_only, defer
+from sqlalchemy.schema import CreateIndex, CreateColumn
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import HTTPException
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 import os
+import sys
 import datetime
-import io
+import time
 import csv
-import json
+import hashlib
+import itertools
+import secrets
+import tempfile
+import orjson
+import redis
+import click
 
 # --- Application Setup ---
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def env_int(name, default):
+    # A malformed value stops startup with one clear line instead of a traceback in every restarted worker.
+    value = os.environ.get(name)
+    if not value: return default
+    try: return int(value)
+    except ValueError: sys.exit(f"{name} must be an integer, got {value!r}")
+
+HOST = os.environ.get('HOST', '127.0.0.1')
+PORT = env_int('PORT', 5000)
+SECRET_KEY = os.environ.get('SECRET_KEY')
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///sattest.db')
+# Hosts such as Render hand out postgres:// URLs, which SQLAlchemy 2 rejects; pin psycopg2, the driver gunicorn.conf.py patches.
+for scheme in ('postgres://', 'postgresql://'):
+    if DATABASE_URL.startswith(scheme): DATABASE_URL = 'postgresql+psycopg2://' + DATABASE_URL[len(scheme):]
+
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sattest.db'
+app.json = OrjsonProvider(app)
+# Every gunicorn worker (and every restart) would otherwise sign sessions with its own random key, logging users out
+# whenever a request lands elsewhere; only the single-process dev server (python app.py) may fall back to one.
+if not SECRET_KEY and __name__ != '__main__': sys.exit("SECRET_KEY must be set (only python app.py runs without it)")
+app.config['SECRET_KEY'] = SECRET_KEY or os.urandom(24)
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'pool_recycle': 280, 'query_cache_size': 1000}
+# The pool is per worker process: workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay under the server's max_connections
+# (about 100 on small managed Postgres plans). The defaults allow 15 per worker, so 4 workers peak at 60.
+# SQLite is left to its own pool choice; the in-memory StaticPool rejects these options.
+if not DATABASE_URL.startswith('sqlite'): app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=env_int('DB_POOL_SIZE', 5), max_overflow=env_int('DB_MAX_OVERFLOW', 10), pool_timeout=10, pool_use_lifo=True)
+# Tags this app's connections in pg_stat_activity; SSL settings come from the URL or PGSSLMODE.
+if DATABASE_URL.startswith('postgresql'): app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'application_name': 'satinsight'}
+
+# Test pages repeat most of their markup between questions, and CSV reports repeat section and outcome tokens on every row.
+app.config.update(COMPRESS_MIMETYPES=['text/html', 'text/css', 'text/javascript', 'application/json', 'text/csv'], COMPRESS_ALGORITHM=['br', 'gzip'], COMPRESS_ALGORITHM_STREAMING=['br', 'deflate'], COMPRESS_BR_LEVEL=4, COMPRESS_LEVEL=6, COMPRESS_MIN_SIZE=500)
+Compress(app)
+
+# Lets freshly started workers load compiled templates from disk instead of recompiling them.
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')
+if JINJA_CACHE_DIR:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+@app.context_processor
+def inject_now():
+    # One clock read per request, however many templates render.
+    if 'now' not in g: g.now = datetime.datetime.now(datetime.timezone.utc)
+    return {'now': g.now}
+
+# With REDIS_URL (or, on a single host, SESSION_FILE_DIR) set, test state lives server-side and the cookie only carries a session id.
+REDIS_URL = os.environ.get('REDIS_URL')
+SESSION_FILE_DIR = os.environ.get('SESSION_FILE_DIR')
+if REDIS_URL:
+    # A plain pool raises once max_connections are checked out; with up to 1000 greenlets per worker, callers queue for a connection instead.
+    redis_pool = redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=env_int('REDIS_MAX_CONNECTIONS', 64), timeout=10)
+    app.config.update(SESSION_TYPE='redis', SESSION_REDIS=redis.Redis(connection_pool=redis_pool))
+elif SESSION_FILE_DIR:
+    app.config.update(SESSION_TYPE='cachelib', SESSION_CACHELIB=FileSystemCache(SESSION_FILE_DIR, threshold=10000))
+if REDIS_URL or SESSION_FILE_DIR:
+    app.config.update(SESSION_SERIALIZATION_FORMAT='msgpack', SESSION_PERMANENT=False)
+    Session(app)
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Stored hashes made with other parameters are upgraded on the next successful login.
+PASSWORD_HASHER = PasswordHasher(time_cost=env_int('ARGON2_TIME_COST', 2),
+                                 memory_cost=env_int('ARGON2_MEMORY_KIB', 64 * 1024),
+                                 parallelism=env_int('ARGON2_PARALLELISM', 1))
+# Verified against when the username is unknown, so a failed login costs the same either way.
+DUMMY_PASSWORD_HASH = PASSWORD_HASHER.hash(os.urandom(16).hex())
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:
+    get_hub = None
+
+def off_hub(func, *args):
+    # Under gevent workers a hash holds the whole worker for its full duration; gevent's threadpool runs it on an
+    # OS thread (argon2 and hashlib release the GIL) while other greenlets keep serving. Thread workers call directly.
+    if get_hub is not None and is_module_patched('socket'): return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
 # --- Database Models ---
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
+    username = db.Column(db.String(100), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(200), nullable=False)
-    scores = db.relationship('Score', backref='user', lazy=True)
+    # Score lists are always fetched with an explicit, limited query; an implicit lazy load would be an N+1 in waiting.
+    scores = db.relationship('Score', back_populates='user', lazy='raise_on_sql')
+
+    # Usernames are matched case-insensitively; this also keeps 'Alice' and 'alice' from both registering.
+    __table_args__ = (db.Index('ix_user_username_lower', db.func.lower(username), unique=True),)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = off_hub(PASSWORD_HASHER.hash, password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if self.password_hash.startswith('$argon2'):
+            try: off_hub(PASSWORD_HASHER.verify, self.password_hash, password)
+            except (VerificationError, InvalidHashError): return False
+            needs_rehash = PASSWORD_HASHER.check_needs_rehash(self.password_hash)
+        else:
+            # Accounts created before argon2id carry a Werkzeug hash; upgrade it on the first good login.
+            if not off_hub(check_password_hash, self.password_hash, password): return False
+            needs_rehash = True
+        if needs_rehash: self.set_password(password); db.session.commit()
+        return True
 
 class Score(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,179 +157,92 @@ class Score(db.Model):
     correct_count = db.Column(db.Integer)
     total_answered = db.Column(db.Integer)
     answers_data = db.Column(db.Text, nullable=True)
+    # The test session's submit_token; unique, so a repeated submit of the same attempt can't insert a second row.
+    submit_token = db.Column(db.String(32), nullable=True)
+    user = db.relationship('User', back_populates='scores', lazy='raise_on_sql')
+
+    # Serves the dashboard's per-user listing in timestamp order without a sort step.
+    __table_args__ = (db.Index('ix_score_user_ts', user_id, timestamp.desc()),
+                      db.Index('ix_score_submit_token', submit_token, unique=True))
+
+    def answers(self):
+        cached = self.__dict__.get('_answers_cache')
+        if cached is None:
+            cached = self._answers_cache = orjson.loads(self.answers_data) if self.answers_data else {}
+        return cached
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    try: return db.session.get(User, int(user_id))
+    except (ValueError, TypeError): return None
+
+def find_user_by_username(username):
+    if not username: return None
+    # Both sides are folded by the database's lower(), exactly as the index is; Python's lower() folds non-ASCII letters SQLite leaves alone.
+    # A database that predates the index may hold case variants ('Bob' and 'bob'); the exact spelling wins.
+    return db.session.execute(db.select(User).where(db.func.lower(User.username) == db.func.lower(username)).order_by(User.username != username).limit(1)).scalar_one_or_none()
 
 # --- QUESTION DATA (from SAT Practice Test #6) ---
-QUESTIONS_DATA = {
-    "reading_writing": [
-        {
-            "id": "rw1", "module": 1, "passage": None,
-            "text": "Though not closely related, the hedgehog tenrecs of Madagascar share basic ______ true hedgehogs, including protective spines, pointed snouts, and small body size-traits the two groups of mammals independently developed in response to equivalent roles in their respective habitats.",
-            "options": ["examples of", "concerns about", "indications of", "similarities with"],
-            "correctAnswer": "similarities with", "topic": "Words in Context", "difficulty": "Easy"
-        },
-        {
-            "id": "rw2", "module": 1,
-            "passage": "The following text is adapted from James Baldwin's 1956 novel Giovanni's Room. The narrator is riding in a taxi down a street lined with food vendors and shoppers in Paris, France.\n'The multitude of Paris seems to be dressed in blue every day but Sunday, when, for the most part, they put on an unbelievably festive black. Here they were now, in blue, disputing, every inch, our passage, with their wagons, handtrucks, their bursting baskets carried at an angle steeply self-confident on the back.'",
-            "text": "As used in the text, what does the word \"disputing\" most nearly mean?",
-            "options": ["Arguing about", "Disapproving of", "Asserting possession of", "Providing resistance to"],
-            "correctAnswer": "Providing resistance to", "topic": "Words in Context", "difficulty": "Medium"
-        },
-        {
-            "id": "rw3", "module": 1,
-            "passage": "When classical pianist Martha Argerich performs, it appears as if the music is coming to her spontaneously. She's highly skilled technically, but because of how freely she plays and her willingness to take risks, she seems relaxed and natural. Her apparent ease, however, is due to a tremendous amount of preparation. Despite Argerich's experience and virtuosity, she never takes for granted that she knows a piece of music. Instead, she approaches the music as if encountering it for the first time and tries to understand it anew.",
-            "text": "Which choice best states the main purpose of the text?",
-            "options": ["To provide details about how Argerich identifies which pieces of music she will perform", "To assert that Argerich's performances look effortless because of how she prepares for them", "To discuss the kinds of music Argerich feels most comfortable encountering for the first time", "To describe the unique way that Argerich approaches music she hasn't performed before"],
-            "correctAnswer": "To assert that Argerich's performances look effortless because of how she prepares for them", "topic": "Main Purpose", "difficulty": "Medium"
-        },
-        {
-            "id": "rw4", "module": 1,
-            "passage": "Text 1\nIn 1954 George Balanchine choreographed a production of The Nutcracker... But the show is stuck in the past, with an old-fashioned story and references, so it should no longer be produced. Ballet needs to create new traditions if it wants to stay relevant to contemporary audiences.\nText 2\nThe Nutcracker is outdated, but it should be kept because it's a holiday favorite and provides substantial income... Although it can be behind the times, there are creative ways to update the show... Her show Hot Chocolate Nutcracker combines ballet, tap, hip-hop, and other styles...",
-            "text": "Based on the texts, how would the author of Text 2 most likely respond to the underlined claim in Text 1?",
-            "options": ["By questioning the idea that the story of The Nutcracker is stuck in the past...", "By agreeing that contemporary audiences have largely stopped going...", "By pointing out that most dance companies could increase their incomes...", "By suggesting that dance companies should consider offering revised versions of The Nutcracker instead of completely rejecting the show"],
-            "correctAnswer": "By suggesting that dance companies should consider offering revised versions of The Nutcracker instead of completely rejecting the show", "topic": "Comparing Texts", "difficulty": "Medium"
-        },
-        {
-            "id": "rw5", "module": 1,
-            "passage": "| Year | Number of cars produced | Number of companies producing cars |\n| :--- | :--- | :--- |\n| 1910 | 123,990 | 320 |\n| 1915 | 548,139 | 224 |\n| 1920 | 1,651,625 | 197 |\n| 1925 | 3,185,881 | 80 |",
-            "text": "The student notes that, according to the table, from 1910 to 1925 ______",
-            "options": ["the number of cars produced increased but the number of companies producing cars decreased.", "both the number of cars produced and the number of companies producing cars remained unchanged.", "the number of cars produced decreased but the number of companies producing cars remained unchanged.", "both the number of cars produced and the number of companies producing cars increased."],
-            "correctAnswer": "the number of cars produced increased but the number of companies producing cars decreased.", "topic": "Data Interpretation", "difficulty": "Easy"
-        },
-        {
-            "id": "rw6", "module": 1,
-            "passage": "External shopping cues are a type of marketing that uses obvious messaging... The researchers explain that trying to find items in new locations causes shoppers to move through more of the store, exposing them to more products and increasing the likelihood that they'll buy an item they hadn't planned on purchasing.",
-            "text": "Which response from a survey given to shoppers who made a purchase at a retail store best supports the researchers' explanation?",
-            "options": ["\"I needed to buy some cleaning supplies, but they weren't in their regular place. While I was looking for them, I saw this interesting notebook and decided to buy it, too.\"", "\"I didn't buy everything on my shopping list today. I couldn't find a couple of the items in the store, even though I looked all over for them.\"", "\"The store sent me a coupon for a new brand of soup, so I came here to find out what kinds of soup that brand offers. I decided to buy a few cans because I had the coupon.\"", "\"This store is larger than one that's closer to where I live, and it carries more products. I came here to buy some things that the other store doesn't always have.\""],
-            "correctAnswer": "\"I needed to buy some cleaning supplies, but they weren't in their regular place. While I was looking for them, I saw this interesting notebook and decided to buy it, too.\"", "topic": "Supporting Claims", "difficulty": "Medium"
-        },
-        {
-            "id": "rw7", "module": 1,
-            "passage": "To investigate potential cognitive benefits of taking leave from work...researchers concluded that longer leave times might not confer a greater cognitive benefit than shorter leave times do. [A bar chart shows that for the second and third tests, the '2-4 days leave' group had higher attentiveness scores than the '1-5 weeks leave' group.]",
-            "text": "Which choice best describes data from the graph that support the researchers' conclusion?",
-            "options": ["...participants who took 2-4 days of leave had higher average attentiveness scores than did those who took no leave...", "...participants who took 2-4 days of leave had lower average attentiveness scores than...", "In both the second and third test administrations, participants who took 2-4 days of leave had higher average attentiveness scores than did participants who took 1-5 weeks of leave.", "...participants who took 2-4 days of leave had higher average attentiveness scores than did those who took no leave."],
-            "correctAnswer": "In both the second and third test administrations, participants who took 2-4 days of leave had higher average attentiveness scores than did participants who took 1-5 weeks of leave.", "topic": "Data Interpretation", "difficulty": "Hard"
-        },
-        {
-            "id": "rw8", "module": 1, "passage": None,
-            "text": "______ by businessman William A.G. Brown, the saloon was known to offer elegant accommodations and an inclusive environment.",
-            "options": ["Created", "Creates", "Creating", "Create"],
-            "correctAnswer": "Created", "topic": "Grammar", "difficulty": "Easy"
-        },
-        {
-            "id": "rw9", "module": 1, "passage": None,
-            "text": "It's an example of antimetabole, a writing technique that ______ emphasis by repeating a statement in a reversed order.",
-            "options": ["create", "are creating", "have created", "creates"],
-            "correctAnswer": "creates", "topic": "Grammar", "difficulty": "Easy"
-        },
-        {
-            "id": "rw10", "module": 1, "passage": None,
-            "text": "A ray diagram reveals how this ______ the hole's small size restricts light to a single ray, all light passing through the hole can only arrive at a single destination, eliminating diffraction and ensuring a clear image.",
-            "options": ["works because", "works. Because", "works, it's because", "works: it's because"],
-            "correctAnswer": "works because", "topic": "Punctuation", "difficulty": "Medium"
-        },
-        {
-            "id": "rw11", "module": 1, "passage": None,
-            "text": "Before it unveiled a massive new gallery in 2009, the Art Institute of Chicago was only able to display about 5% of its art collection. ______ the museum is able to display close to 30% of its collection.",
-            "options": ["Additionally,", "For example,", "Nevertheless,", "Today,"],
-            "correctAnswer": "Today,", "topic": "Logical Transitions", "difficulty": "Easy"
-        },
-        {
-            "id": "rw12", "module": 1,
-            "passage": "Notes:\n- In the 1930s, the Imperial Sugar Cane Institute in India sought to limit the country's dependence on imported sugarcane.\n- The institute enlisted botanist Janaki Ammal to breed a local variety of sugarcane.\n- She crossbred the imported sugarcane species Saccharum officinarum with grasses native to India.\n- She succeeded in creating sugarcane hybrids well suited to India's climate.",
-            "text": "The student wants to emphasize Janaki Ammal's achievement. Which choice most effectively uses relevant information from the notes to accomplish this goal?",
-            "options": ["By crossbreeding the imported sugarcane species Saccharum officinarum with grasses native to India, Ammal succeeded in creating sugarcane hybrids well suited to India's climate.", "In the 1930s, the Imperial Sugar Cane Institute, which enlisted Ammal, sought to limit dependence on imported sugarcane.", "Ammal was enlisted by the Imperial Sugar Cane Institute at a time when a local variety of sugarcane needed to be produced.", "As part of efforts to breed a local variety of sugarcane, an imported sugarcane species called Saccharum officinarum was crossbred with grasses native to India."],
-            "correctAnswer": "By crossbreeding the imported sugarcane species Saccharum officinarum with grasses native to India, Ammal succeeded in creating sugarcane hybrids well suited to India's climate.", "topic": "Rhetorical Synthesis", "difficulty": "Medium"
-        }
-    ],
-    "math": [
-        {
-            "id": "m1", "module": 1, "passage": None,
-            "text": "(p + 3) + 8 = 10\nWhat value of p is the solution to the given equation?",
-            "options": ["-1", "5", "15", "21"], "correctAnswer": "-1", "topic": "Algebra", "difficulty": "Easy"
-        },
-        {
-            "id": "m2", "module": 1, "passage": None,
-            "text": "An object was launched upward from a platform. The graph shown models the height above ground, y, in meters, of the object x seconds after it was launched. [A parabola opening downwards, starting at (0, 10), reaching a vertex near (2.5, 28), and hitting the x-axis around 4.5.]\n\nFor which of the following intervals of time was the height of the object increasing for the entire interval?",
-            "options": ["From x=0 to x=2", "From x=0 to x=4", "From x=2 to x=3", "From x=3 to x=4"],
-            "correctAnswer": "From x=0 to x=2", "topic": "Data Interpretation", "difficulty": "Easy"
-        },
-        {
-            "id": "m3", "module": 1, "passage": None,
-            "text": "How many yards are equivalent to 1,116 inches? (1 yard = 36 inches)",
-            "options": [], "correctAnswer": "31", "topic": "Problem Solving", "difficulty": "Easy"
-        },
-        {
-            "id": "m4", "module": 1, "passage": None,
-            "text": "P(t) = 1,800(1.02)ᵗ\nThe function P gives the estimated number of marine mammals in a certain area, where t is the number of years since a study began. What is the best interpretation of P(0) = 1,800 in this context?",
-            "options": ["The estimated number of marine mammals in the area was 102 when the study began.", "The estimated number of marine mammals in the area was 1,800 when the study began.", "The estimated number of marine mammals in the area increased by 102 each year during the study.", "The estimated number of marine mammals in the area increased by 1,800 each year during the study."],
-            "correctAnswer": "The estimated number of marine mammals in the area was 1,800 when the study began.", "topic": "Algebra", "difficulty": "Easy"
-        },
-        {
-            "id": "m5", "module": 1, "passage": None,
-            "text": "The figure shows the lengths, in inches, of two sides of a right triangle. [A right triangle with legs of length 3 and 5.]\n\nWhat is the area of the triangle, in square inches?",
-            "options": [], "correctAnswer": "7.5", "topic": "Geometry", "difficulty": "Easy"
-        },
-        {
-            "id": "m6", "module": 1, "passage": None,
-            "text": "The relationship between two variables, x and y, is linear. For every increase in the value of x by 1, the value of y increases by 8. When the value of x is 2, the value of y is 18.\n\nWhich equation represents this relationship?",
-            "options": ["y = 2x + 18", "y = 2x + 8", "y = 8x + 2", "y = 8x + 26"],
-            "correctAnswer": "y = 8x + 2", "topic": "Algebra", "difficulty": "Medium"
-        },
-        {
-            "id": "m7", "module": 1, "passage": None,
-            "text": "w² + 12w - 40 = 0\nWhich of the following is a solution to the given equation?",
-            "options": ["6 - 2√19", "2√19", "√19", "-6 + 2√19"],
-            "correctAnswer": "-6 + 2√19", "topic": "Advanced Math", "difficulty": "Hard"
-        },
-        {
-            "id": "m8", "module": 1, "passage": None,
-            "text": "The graph of y = 2x² + bx + c is shown, where b and c are constants. [A parabola opening upwards with its vertex at (-1, -8) and a y-intercept at (0, -6).]\n\nWhat is the value of bc?",
-            "options": [], "correctAnswer": "-24", "topic": "Advanced Math", "difficulty": "Hard"
-        },
-        {
-            "id": "m9", "module": 1, "passage": None,
-            "text": "Right triangle ABC is shown. Angle C is the right angle. [A right triangle ABC, with the right angle at C. The hypotenuse AB has length 54, and angle B is 30°.]\n\nWhat is the value of tan A?",
-            "options": ["√3/54", "1/√3", "√3", "27√3"],
-            "correctAnswer": "√3", "topic": "Trigonometry", "difficulty": "Medium"
-        },
-        {
-            "id": "m10", "module": 1, "passage": None,
-            "text": "A rectangle has an area of 155 square inches. The length of the rectangle is 4 inches less than 7 times the width of the rectangle.\n\nWhat is the width of the rectangle, in inches?",
-            "options": [], "correctAnswer": "5", "topic": "Algebra", "difficulty": "Medium"
-        }
-    ]
-}
+# Kept in questions.json so the bank can be edited without touching code.
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'questions.json'), 'rb') as f: QUESTIONS_DATA = orjson.loads(f.read())
 
 ALL_QUESTIONS = QUESTIONS_DATA["reading_writing"] + QUESTIONS_DATA["math"]
 ALL_QUESTIONS_MAP = {q['id']: q for q in ALL_QUESTIONS}
 ORDERED_QUESTION_IDS = [q['id'] for q in ALL_QUESTIONS]
+# Stored in the test session in place of the ID list. Derived from the order itself, so editing questions.json to add,
+# drop or reorder questions retires in-progress tests on its own; rewording a question keeps them valid.
+QUESTION_BANK_VERSION = hashlib.sha1('\n'.join(ORDERED_QUESTION_IDS).encode()).hexdigest()[:16]
+
+# ALL_QUESTIONS lists every reading & writing question before any math one, so the section is a bound check on the index.
+FIRST_MATH_IDX = len(QUESTIONS_DATA["reading_writing"])
+
+# Column-wise views of the question bank, indexed by position in ORDERED_QUESTION_IDS.
+QID_TO_IDX = {q_id: i for i, q_id in enumerate(ORDERED_QUESTION_IDS)}
+CORRECT_ANS = tuple(q['correctAnswer'] for q in ALL_QUESTIONS)
+SECTION_NAME = tuple("Math" if i >= FIRST_MATH_IDX else "Reading & Writing" for i in range(len(ORDERED_QUESTION_IDS)))
+SECTION_LABEL = tuple(f"Section {1 if name == 'Math' else 2}, Module {q.get('module', 1)}: {name}" for q, name in zip(ALL_QUESTIONS, SECTION_NAME))
+TOPIC = tuple(q.get("topic", "N/A") for q in ALL_QUESTIONS)
 
 TOTAL_QUESTIONS = len(ALL_QUESTIONS)
 TEST_DURATION_MINUTES = 30
+DASHBOARD_SCORE_LIMIT = 50
+TEST_SESSION_KEYS = frozenset(('current_question_index', 'answers', 'start_ts', 'test_version', 'marked_for_review', 'submit_token'))
+
+# Client-facing question payloads never carry the answer key. The bank is static, so each body is encoded once.
+QUESTION_JSON = {q['id']: orjson.dumps({k: v for k, v in q.items() if k != 'correctAnswer'}) for q in ALL_QUESTIONS}
+QUESTION_ETAGS = {q_id: hashlib.sha1(body).hexdigest() for q_id, body in QUESTION_JSON.items()}
+ALL_QUESTIONS_JSON = b'[' + b','.join(QUESTION_JSON[q_id] for q_id in ORDERED_QUESTION_IDS) + b']'
+ALL_QUESTIONS_ETAG = hashlib.sha1(ALL_QUESTIONS_JSON).hexdigest()
+# questions.json can change between deploys under the same URLs, so clients cache but always revalidate (a 304 when unchanged).
+QUESTION_CACHE_CONTROL = 'private, no-cache'
 
 def initialize_test_session():
-    session['current_question_index'] = 0
-    session['answers'] = {}
-    session['start_time'] = datetime.datetime.utcnow().isoformat() + "Z"
-    session['test_questions_ids_ordered'] = ORDERED_QUESTION_IDS[:]
-    session['marked_for_review'] = {}
+    session.update({'current_question_index': 0,
+                    'answers': {},
+                    'start_ts': time.time(),
+                    'test_version': QUESTION_BANK_VERSION,
+                    'marked_for_review': {},
+                    'submit_token': secrets.token_urlsafe(16)})
+
+def clear_test_session():
+    for key in session.keys() & TEST_SESSION_KEYS: del session[key]
+
+def results_response(summary, score_id):
+    clear_test_session()
+    flash('Test results saved!', 'success')
+    # Pop the flashes now: the session is saved before a streamed body is rendered.
+    get_flashed_messages()
+    return Response(stream_template('results_page.html', results=summary, score_id=score_id))
 
 def calculate_mock_score(answers):
-    correct_count = 0; math_correct = 0; math_total = 0; rw_correct = 0; rw_total = 0
+    correct_count = 0; math_correct = 0; math_total = 0; scored_total = 0
     for q_id, user_answer in answers.items():
-        question_detail = ALL_QUESTIONS_MAP.get(q_id)
-        if not question_detail: continue
-        is_math = q_id.startswith('m')
-        if is_math: math_total += 1
-        else: rw_total += 1
-        if user_answer == question_detail['correctAnswer']:
-            correct_count += 1
-            if is_math: math_correct += 1
-            else: rw_correct += 1
+        i = QID_TO_IDX.get(q_id)
+        if i is None: continue
+        is_math = i >= FIRST_MATH_IDX; correct = user_answer == CORRECT_ANS[i]
+        scored_total += 1; math_total += is_math
+        correct_count += correct; math_correct += correct & is_math
+    rw_total = scored_total - math_total; rw_correct = correct_count - math_correct
     math_score_ratio = (math_correct / max(1, math_total)) if math_total > 0 else 0
     rw_score_ratio = (rw_correct / max(1, rw_total)) if rw_total > 0 else 0
     mock_math_score = max(200, min(800, 200 + int(math_score_ratio * 600)))
@@ -228,43 +255,68 @@ def calculate_mock_score(answers):
     elif not weaknesses and math_total == 0 and rw_total == 0: weaknesses.append("No answers to analyze."); recommendations.append("Complete the test for analysis.")
     return {"total_score": mock_total_score, "math_score": mock_math_score, "rw_score": mock_rw_score, "correct_count": correct_count, "total_answered": len(answers), "weaknesses": weaknesses, "recommendations": recommendations}
 
+class EchoBuffer:
+    def write(self, value): return value
+
+CSV_WRITER = csv.writer(EchoBuffer())
+
+def csv_field(value):
+    # The quoting csv.writer applies by default (QUOTE_MINIMAL), for a single field.
+    if value is None: return ''
+    value = str(value)
+    if '"' in value or ',' in value or '\n' in value or '\r' in value: return '"' + value.replace('"', '""') + '"'
+    return value
+
+CSV_HEADER_LINE = CSV_WRITER.writerow(("Question Number", "Section", "Skill Type", "Your Answer", "Correct Answer", "Outcome"))
+# Per question: the formatted "number,section,skill type," prefix, the correct answer and its formatted field.
+# Only the user's answer and the outcome vary, so each report row is a single string build.
+CSV_ROW_PARTS = {q_id: (CSV_WRITER.writerow((seq, section, topic))[:-2] + ',', correct, csv_field(correct))
+                 for q_id, seq, section, topic, correct in zip(ORDERED_QUESTION_IDS, itertools.count(1), SECTION_NAME, TOPIC, CORRECT_ANS)}
+
+def csv_answer_lines(user_answers_dict):
+    for q_id, (prefix, correct_answer, correct_field) in CSV_ROW_PARTS.items():
+        user_answer = user_answers_dict.get(q_id, "Not Answered")
+        if user_answer == correct_answer: outcome = "Correct"
+        elif user_answer == "Not Answered": outcome = "Not Answered"
+        else: outcome = "Incorrect"
+        yield f"{prefix}{csv_field(user_answer)},{correct_field},{outcome}\r\n"
+
 def generate_csv_report(score_obj):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Question Number", "Section", "Skill Type", "Your Answer", "Correct Answer", "Outcome"])
+    # Answers are decoded here, before streaming starts, so the generator never touches the ORM object.
     if not score_obj or not score_obj.answers_data:
-        writer.writerow(["N/A"] * 6)
-        output.seek(0)
-        return output.getvalue()
-    try:
-        user_answers_dict = json.loads(score_obj.answers_data)
-    except json.JSONDecodeError:
-        writer.writerow(["Error decoding answers"] + ["N/A"] * 5)
-        output.seek(0)
-        return output.getvalue()
-    question_sequence_number = 0
-    for q_id in ORDERED_QUESTION_IDS:
-        question_sequence_number += 1
-        question_detail = ALL_QUESTIONS_MAP.get(q_id)
-        if not question_detail:
-            writer.writerow([question_sequence_number, "Unknown", "Unknown", "N/A", "N/A", "Question detail missing"])
-            continue
-        section_val = "Math" if q_id.startswith('m') else "Reading & Writing"
-        skill_type_val = question_detail.get("topic", "N/A")
-        user_answer_val = user_answers_dict.get(q_id, "Not Answered")
-        correct_answer_val = question_detail.get("correctAnswer", "N/A")
-        outcome_val = "Incorrect"
-        if user_answer_val == correct_answer_val:
-            outcome_val = "Correct"
-        elif user_answer_val == "Not Answered":
-            outcome_val = "Not Answered"
-        writer.writerow([question_sequence_number, section_val, skill_type_val, user_answer_val, correct_answer_val, outcome_val])
-    output.seek(0)
-    return output.getvalue()
+        lines = [CSV_WRITER.writerow(["N/A"] * 6)]
+    else:
+        try:
+            lines = csv_answer_lines(score_obj.answers())
+        except orjson.JSONDecodeError:
+            lines = [CSV_WRITER.writerow(["Error decoding answers"] + ["N/A"] * 5)]
+    return itertools.chain([CSV_HEADER_LINE], lines)
+
+# Behind nginx, reports are written once to REPORT_CACHE_DIR and served by nginx via X-Accel-Redirect.
+# Example: location /internal_reports/ { internal; alias /var/cache/sat/reports/; }
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR')
+REPORT_ACCEL_PREFIX = os.environ.get('REPORT_ACCEL_PREFIX', '/internal_reports/')
+if REPORT_CACHE_DIR: os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+
+def write_cached_report(score_obj):
+    # Scores never change once saved, so an existing file is always current. The owner and save time are in the name
+    # so a score id reused after a database reset or switch can never be answered with someone else's cached report.
+    name = f"{score_obj.user_id}-{score_obj.id}-{score_obj.timestamp:%Y%m%d%H%M%S%f}.csv"
+    path = os.path.join(REPORT_CACHE_DIR, name)
+    if not os.path.exists(path):
+        # A private temp file per writer, so concurrent downloads of one report never interleave before the atomic rename.
+        fd, tmp_path = tempfile.mkstemp(dir=REPORT_CACHE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', newline='') as f: f.writelines(generate_csv_report(score_obj))
+            os.chmod(tmp_path, 0o644)  # mkstemp creates 0600; nginx usually runs as another user.
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path); raise
+    return name
 
 # --- Routes ---
 @app.route('/')
-def index(): return render_template('index.html', total_questions=TOTAL_QUESTIONS, duration=TEST_DURATION_MINUTES, now=datetime.datetime.utcnow())
+def index(): return render_template('index.html', total_questions=TOTAL_QUESTIONS, duration=TEST_DURATION_MINUTES)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -272,19 +324,26 @@ def register():
     if request.method == 'POST':
         username = request.form.get('username'); password = request.form.get('password')
         if not username or not password: flash('Username and password are required.', 'warning'); return redirect(url_for('register'))
-        if User.query.filter_by(username=username).first(): flash('Username already exists.', 'danger'); return redirect(url_for('register'))
-        new_user = User(username=username); new_user.set_password(password); db.session.add(new_user); db.session.commit(); flash('Registration successful! Please log in.', 'success'); return redirect(url_for('login'))
-    return render_template('register.html', now=datetime.datetime.utcnow())
+        # The case-insensitive unique index rejects taken names, so there is no separate lookup (and no check-then-insert race).
+        new_user = User(username=username); new_user.set_password(password); db.session.add(new_user)
+        try: db.session.commit()
+        except IntegrityError: db.session.rollback(); flash('Username already exists.', 'danger'); return redirect(url_for('register'))
+        flash('Registration successful! Please log in.', 'success'); return redirect(url_for('login'))
+    return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated: return redirect(url_for('index'))
     if request.method == 'POST':
         username = request.form.get('username'); password = request.form.get('password')
-        user = User.query.filter_by(username=username).first()
+        password = password or ''
+        user = find_user_by_username(username)
+        if user is None:
+            try: off_hub(PASSWORD_HASHER.verify, DUMMY_PASSWORD_HASH, password)
+            except VerificationError: pass
         if user and user.check_password(password): login_user(user, remember=request.form.get('remember') == 'on'); flash('Logged in successfully!', 'success'); return redirect(request.args.get('next') or url_for('index'))
         else: flash('Invalid username or password.', 'danger')
-    return render_template('login.html', now=datetime.datetime.utcnow())
+    return render_template('login.html')
 
 @app.route('/logout')
 @login_required
@@ -293,7 +352,8 @@ def logout(): logout_user(); flash('You have been logged out.', 'info'); return
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user_scores = Score.query.filter_by(user_id=current_user.id).order_by(Score.timestamp.desc()).all()
+    user_scores = db.session.execute(db.select(Score).options(defer(Score.answers_data)).where(Score.user_id == current_user.id)
+                                     .order_by(Score.timestamp.desc()).limit(DASHBOARD_SCORE_LIMIT)).scalars().all()
     ist_offset = datetime.timedelta(hours=5, minutes=30)
     ist_timezone = datetime.timezone(ist_offset)
     for score in user_scores:
@@ -301,7 +361,7 @@ def dashboard():
             aware_utc_time = score.timestamp.replace(tzinfo=datetime.timezone.utc)
             local_time = aware_utc_time.astimezone(ist_timezone)
             score.timestamp = local_time
-    return render_template('dashboard.html', scores=user_scores, now=datetime.datetime.utcnow())
+    return render_template('dashboard.html', scores=user_scores)
 
 @app.route('/start_test', methods=['POST'])
 @login_required
@@ -312,40 +372,45 @@ def start_test():
 @app.route('/update_mark_review_status', methods=['POST'])
 @login_required
 def update_mark_review_status():
-    if 'test_questions_ids_ordered' not in session: return jsonify(success=False, error="Test session not found"), 400
+    if session.get('test_version') != QUESTION_BANK_VERSION: return jsonify(success=False, error="Test session not found"), 400
     data = request.get_json()
     if not data: return jsonify(success=False, error="No data received"), 400
     question_id = data.get('question_id'); is_marked = data.get('mark_review')
-    if question_id is None or not isinstance(is_marked, bool): return jsonify(success=False, error="Invalid data"), 400
-    if question_id not in session.get('test_questions_ids_ordered', []): return jsonify(success=False, error="Invalid question ID"), 400
-    session.setdefault('marked_for_review', {})
-    if is_marked: session['marked_for_review'][question_id] = True
-    else: session['marked_for_review'].pop(question_id, None)
-    session.modified = True
+    if not isinstance(question_id, str) or not isinstance(is_marked, bool): return jsonify(success=False, error="Invalid data"), 400
+    if question_id not in QID_TO_IDX: return jsonify(success=False, error="Invalid question ID"), 400
+    marked_map = session.get('marked_for_review') or {}
+    if is_marked != (question_id in marked_map):
+        marked_map = dict(marked_map)
+        if is_marked: marked_map[question_id] = True
+        else: del marked_map[question_id]
+        session['marked_for_review'] = marked_map
     return jsonify(success=True)
 
 @app.route('/test/question/<int:q_num>', methods=['GET', 'POST'])
 @login_required
 def test_question_page(q_num):
-    if 'test_questions_ids_ordered' not in session or not session['test_questions_ids_ordered']:
+    if session.get('test_version') != QUESTION_BANK_VERSION:
+        # A test started against an older question order can't be resumed; its answers may point at the wrong questions.
+        clear_test_session()
         flash('Test session not found or expired. Please start a new test.', 'warning')
         return redirect(url_for('index'))
-    ordered_ids = session['test_questions_ids_ordered']
+    ordered_ids = ORDERED_QUESTION_IDS
     q_idx = q_num - 1
     if not 0 <= q_idx < len(ordered_ids):
         flash('Invalid question number.', 'danger')
         return redirect(url_for('test_question_page', q_num=1))
-    session['current_question_index'] = q_idx
+    if session.get('current_question_index') != q_idx: session['current_question_index'] = q_idx
     question_id = ordered_ids[q_idx]
     question = ALL_QUESTIONS_MAP.get(question_id)
     if not question:
         flash('Error: Question data not found.', 'danger')
         return redirect(url_for('test_question_page', q_num=1))
+    answers_map = session.get('answers') or {}
+    marked_map = session.get('marked_for_review') or {}
     if request.method == 'POST':
         selected_option = request.form.get('answer'); action = request.form.get('action')
-        if selected_option:
-            session.setdefault('answers', {})[question_id] = selected_option
-        session.modified = True
+        if selected_option and answers_map.get(question_id) != selected_option:
+            session['answers'] = {**answers_map, question_id: selected_option}
         if action == 'next':
             if q_num < len(ordered_ids):
                 return redirect(url_for('test_question_page', q_num=q_num + 1))
@@ -355,75 +420,151 @@ def test_question_page(q_num):
             if q_num > 1:
                 return redirect(url_for('test_question_page', q_num=q_num - 1))
         return redirect(url_for('test_question_page', q_num=q_num))
-    current_section_name = "Math" if question_id.startswith('m') else "Reading & Writing"
-    current_module = question.get('module', 1)
-    is_marked = session.get('marked_for_review', {}).get(question_id, False)
-    selected_answer = session.get('answers', {}).get(question_id)
+    is_marked = question_id in marked_map
+    selected_answer = answers_map.get(question_id)
     return render_template('test_page.html',
                            question=question,
                            question_number=q_num,
                            total_questions=TOTAL_QUESTIONS,
-                           current_section=f"Section {1 if current_section_name == 'Math' else 2}, Module {current_module}: {current_section_name}",
-                           start_time_iso=session.get('start_time', datetime.datetime.utcnow().isoformat() + "Z"),
+                           current_section=SECTION_LABEL[QID_TO_IDX[question_id]],
+                           section_name=SECTION_NAME[q_idx],
+                           start_time_ms=int(session.get('start_ts', time.time()) * 1000),
                            test_duration_minutes=TEST_DURATION_MINUTES,
-                           now=datetime.datetime.utcnow(),
                            is_marked_for_review=is_marked,
                            selected_answer=selected_answer,
                            q_idx=q_idx,
                            q_num=q_num)
 
+@app.route('/api/question/<string:q_id>')
+@login_required
+def question_payload(q_id):
+    body = QUESTION_JSON.get(q_id)
+    if body is None: return jsonify(success=False, error="Invalid question ID"), 404
+    response = Response(body, mimetype='application/json')
+    response.set_etag(QUESTION_ETAGS[q_id])
+    response.headers['Cache-Control'] = QUESTION_CACHE_CONTROL
+    return response.make_conditional(request)
+
+@app.route('/api/questions')
+@login_required
+def all_questions_payload():
+    response = Response(ALL_QUESTIONS_JSON, mimetype='application/json')
+    response.set_etag(ALL_QUESTIONS_ETAG)
+    response.headers['Cache-Control'] = QUESTION_CACHE_CONTROL
+    return response.make_conditional(request)
+
 @app.route('/results')
 @login_required
 def results():
-    if 'answers' not in session or 'start_time' not in session:
+    if 'answers' not in session or 'start_ts' not in session:
         flash('No answers or session expired.', 'warning')
         return redirect(url_for('index'))
+    submit_token = session.get('submit_token')
     user_answers = session.get('answers', {})
-    start_time_iso = session.get('start_time')
-    try:
-        if start_time_iso and start_time_iso.endswith('Z'):
-            start_time_iso = start_time_iso[:-1]
-        start_time = datetime.datetime.fromisoformat(start_time_iso)
-    except (ValueError, TypeError):
-        start_time = datetime.datetime.utcnow()
+    time_taken = max(time.time() - session['start_ts'], 0)
     end_time = datetime.datetime.utcnow()
-    time_taken = (end_time - start_time).total_seconds()
     summary = calculate_mock_score(user_answers)
     summary['time_taken_formatted'] = f"{int(time_taken // 60)}m {int(time_taken % 60)}s"
-    answers_json = json.dumps(user_answers)
-    score = Score(user_id=current_user.id,
-                  total_score=summary['total_score'],
-                  math_score=summary['math_score'],
-                  rw_score=summary['rw_score'],
-                  correct_count=summary['correct_count'],
-                  total_answered=summary['total_answered'],
-                  answers_data=answers_json,
-                  timestamp=end_time)
-    db.session.add(score)
-    db.session.commit()
-    for key in ['current_question_index', 'answers', 'start_time', 'test_questions_ids_ordered', 'marked_for_review']:
-        session.pop(key, None)
-    flash('Test results saved!', 'success')
-    return render_template('results_page.html', results=summary, score_id=score.id, now=datetime.datetime.utcnow())
+    answers_json = orjson.dumps(user_answers).decode()
+    try:
+        score_id = db.session.execute(db.insert(Score).values(user_id=current_user.id,
+                                                             total_score=summary['total_score'],
+                                                             math_score=summary['math_score'],
+                                                             rw_score=summary['rw_score'],
+                                                             correct_count=summary['correct_count'],
+                                                             total_answered=summary['total_answered'],
+                                                             answers_data=answers_json,
+                                                             submit_token=submit_token,
+                                                             timestamp=end_time).returning(Score.id)).scalar_one()
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        # A double-click, or a retry served by another worker, hits the unique submit_token: show the attempt already saved.
+        saved = submit_token and isinstance(e, IntegrityError) and db.session.execute(
+            db.select(Score.id, Score.answers_data).where(Score.submit_token == submit_token, Score.user_id == current_user.id)).one_or_none()
+        if saved:
+            summary.update(calculate_mock_score(orjson.loads(saved.answers_data) if saved.answers_data else {}))
+            return results_response(summary, saved.id)
+        app.logger.error("Could not save score for user %s: %s", current_user.id, e, exc_info=app.debug)
+        flash('Could not save your results. Please try submitting again.', 'danger')
+        return redirect(url_for('test_question_page', q_num=TOTAL_QUESTIONS))
+    return results_response(summary, score_id)
 
 @app.route('/download_report/<int:score_id>/<string:report_format>')
 @login_required
 def download_report(score_id, report_format):
-    score = Score.query.filter_by(id=score_id, user_id=current_user.id).first_or_404()
-    if report_format == 'csv': return Response(generate_csv_report(score), mimetype="text/csv", headers={"Content-disposition": f"attachment; filename=report_{score_id}.csv"})
+    score = db.first_or_404(db.select(Score).options(load_only(Score.answers_data, Score.user_id, Score.timestamp)).where(Score.id == score_id, Score.user_id == current_user.id))
+    if report_format == 'csv':
+        headers = {"Content-disposition": f"attachment; filename=report_{score_id}.csv"}
+        if REPORT_CACHE_DIR:
+            headers['X-Accel-Redirect'] = f"{REPORT_ACCEL_PREFIX}{write_cached_report(score)}"
+            return Response(mimetype="text/csv", headers=headers)
+        return Response(generate_csv_report(score), mimetype="text/csv", headers=headers)
     flash("Invalid report format.", "danger"); return redirect(request.referrer or url_for('dashboard'))
 
 @app.route('/reset_test', methods=['POST'])
 @login_required
 def reset_test():
-    for key in ['current_question_index', 'answers', 'start_time', 'test_questions_ids_ordered', 'marked_for_review']: session.pop(key, None)
+    clear_test_session()
     flash('Test session reset.', 'info'); return redirect(url_for('index'))
 
-@app.errorhandler(404)
-def e404(e): return render_template('error_page.html', error_code=404, error_name="Page Not Found", error_message="Sorry, the page you are looking for does not exist."), 404
-@app.errorhandler(500)
-def e500(e): db.session.rollback(); return render_template('error_page.html', error_code=500, error_name="Internal Server Error", error_message="We are experiencing some technical difficulties. Please try again later."), 500
+ERROR_PAGE_TEXT = {
+    404: ("Page Not Found", "Sorry, the page you are looking for does not exist."),
+    500: ("Internal Server Error", "We are experiencing some technical difficulties. Please try again later."),
+}
+
+@app.errorhandler(HTTPException)
+def http_error(e):
+    app.logger.warning("%s %s %s", e.code, e.name, request.url)
+    if e.code >= 500: db.session.rollback()
+    error_name, error_message = ERROR_PAGE_TEXT.get(e.code, (e.name, e.description))
+    # Keep the exception's own headers, such as Allow on a 405.
+    response = e.get_response()
+    response.set_data(render_template('error_page.html', error_code=e.code, error_name=error_name, error_message=error_message))
+    return response
+
+@app.errorhandler(Exception)
+def server_error(e):
+    # Let the debugger (python app.py) and test clients see the real traceback.
+    if app.debug or app.testing or app.config['PROPAGATE_EXCEPTIONS']: raise e
+    db.session.rollback()
+    app.logger.error("Unhandled exception on %s", request.path, exc_info=e)
+    error_name, error_message = ERROR_PAGE_TEXT[500]
+    return render_template('error_page.html', error_code=500, error_name=error_name, error_message=error_message), 500
+
+# Compile every template up front so no request pays for parsing one.
+for template_name in app.jinja_env.list_templates(): app.jinja_env.get_template(template_name)
+
+def create_schema():
+    # One reflection pass instead of a has_table probe per model.
+    inspector = db.inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    missing = [table for table in db.metadata.sorted_tables if table.name not in existing]
+    with db.engine.begin() as conn: db.metadata.create_all(conn, tables=missing, checkfirst=False)
+    # Columns added since a table was created (all nullable, e.g. score.submit_token) are appended in place.
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing: continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    conn.execute(db.text(f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}"))
+    # New tables get their indexes above; older tables may predate some of them (registration relies on the case-insensitive username index).
+    # Each index gets its own transaction so one that existing rows violate doesn't take the rest, or startup, down with it.
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing: continue
+        for index in table.indexes:
+            try:
+                with db.engine.begin() as conn: conn.execute(CreateIndex(index, if_not_exists=True))
+            except IntegrityError:
+                app.logger.warning("Skipped index %s: existing rows violate it (e.g. usernames differing only in case). Until they are merged, only the exact-match unique constraint applies.", index.name)
+    return [table.name for table in missing]
+
+@app.cli.command('init-db', help='Create the database tables and indexes.')
+def init_db_command():
+    created = create_schema()
+    click.echo(f"Initialized the database. Created tables: {', '.join(created) or 'none'}.")
 
 if __name__ == '__main__':
-    with app.app_context(): db.create_all()
-    app.run(debug=True)
+    with app.app_context(): create_schema()
+    app.run(host=HOST, port=PORT, debug=True)
@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+import sys
+
+wsgi_app = 'app:app'
+
+def env_int(name, default):
+    # Same rule as app.env_int; importing app here would load it in the master before gevent can patch anything.
+    value = os.environ.get(name)
+    if not value: return default
+    try: return int(value)
+    except ValueError: sys.exit(f"{name} must be an integer, got {value!r}")
+
+# Handlers mostly wait on Postgres, so one gevent worker per core serves many requests concurrently.
+# GUNICORN_WORKER_CLASS=gthread is the fallback where gevent can't be used.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = env_int('GUNICORN_WORKER_CONNECTIONS', 1000)
+threads = env_int('GUNICORN_THREADS', 5)
+# Each worker holds its own DB pool (DB_POOL_SIZE + DB_MAX_OVERFLOW in app.py); size the two together.
+workers = env_int('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count()))
+# gevent has to patch the standard library before the app imports it, so only thread/sync workers preload.
+preload_app = worker_class != 'gevent'
+max_requests = 1000
+max_requests_jitter = 100
+timeout = 60
+
+def post_fork(server, worker):
+    if server.cfg.worker_class_str == 'gevent':
+        # Make psycopg2 yield to the gevent hub while it waits on the database.
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    if server.cfg.preload_app:
+        # Connections opened in the parent must not be shared with the forked worker.
+        from app import app, db
+        with app.app_context(): db.engine.dispose(close=False)